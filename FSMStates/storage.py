@@ -0,0 +1,35 @@
+from typing import Any, Dict, Optional
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+
+class MongoStorage(BaseStorage):
+    def __init__(self, mongodb):
+        self.mongodb = mongodb
+
+    @staticmethod
+    def make_key(key: StorageKey) -> str:
+        return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id}:{key.destiny}"
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        if isinstance(state, State):
+            state = state.state
+        await self.mongodb.set_fsm_field(self.make_key(key), "state", state)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        document = await self.mongodb.get_fsm_document(self.make_key(key))
+        if document is None:
+            return None
+        return document.get("state")
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        await self.mongodb.set_fsm_field(self.make_key(key), "data", data)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        document = await self.mongodb.get_fsm_document(self.make_key(key))
+        if document is None:
+            return {}
+        return document.get("data") or {}
+
+    async def close(self) -> None:
+        pass
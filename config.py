@@ -13,6 +13,9 @@ def get_environment():
         ENV_MONGODB_DATABASE = "MONGODB_DATABASE"
         ENV_MONGODB_USERNAME = "MONGODB_USERNAME"
         ENV_MONGODB_PASSWORD = "MONGODB_PASSWORD"
+        ENV_STORAGE_CHAT_ID = "STORAGE_CHAT_ID"
+        ENV_WEBHOOK_URL = "WEBHOOK_URL"
+        ENV_WEBHOOK_SECRET = "WEBHOOK_SECRET"
     elif ENV_TYPE == "DEV":
         ENV_TOKEN = "DEV_BOT_TOKEN"
         ENV_MONGODB_HOST = "DEV_MONGODB_HOST"
@@ -20,6 +23,9 @@ def get_environment():
         ENV_MONGODB_DATABASE = "DEV_MONGODB_DATABASE"
         ENV_MONGODB_USERNAME = "DEV_MONGODB_USERNAME"
         ENV_MONGODB_PASSWORD = "DEV_MONGODB_PASSWORD"
+        ENV_STORAGE_CHAT_ID = "DEV_STORAGE_CHAT_ID"
+        ENV_WEBHOOK_URL = "DEV_WEBHOOK_URL"
+        ENV_WEBHOOK_SECRET = "DEV_WEBHOOK_SECRET"
     else:
         raise "Неверная конфигурация среды"
 
@@ -53,6 +59,15 @@ def get_environment():
     if MONGODB_PASSWORD is None:
         raise f"{ENV_MONGODB_PASSWORD} не установлен"
 
+    # Чат, в который воркер загружает картинки страниц, чтобы получить их file_id.
+    # Если не задан, расписание отправляется файлами с диска.
+    STORAGE_CHAT_ID: str = getenv(ENV_STORAGE_CHAT_ID) or None
+
+    # Публичный URL фронтенда. Если задан, бот работает через webhook и его можно
+    # запускать в нескольких репликах, иначе используется long polling
+    WEBHOOK_URL: str = getenv(ENV_WEBHOOK_URL) or None
+    WEBHOOK_SECRET: str = getenv(ENV_WEBHOOK_SECRET) or None
+
     config = {
         "BOT_TOKEN": TOKEN,
         "MONGODB_HOST": MONGODB_HOST,
@@ -60,9 +75,23 @@ def get_environment():
         "MONGODB_DATABASE": MONGODB_DATABASE,
         "MONGODB_USERNAME": MONGODB_USERNAME,
         "MONGODB_PASSWORD": MONGODB_PASSWORD,
+        "STORAGE_CHAT_ID": STORAGE_CHAT_ID,
+        "WEBHOOK_URL": WEBHOOK_URL,
+        "WEBHOOK_SECRET": WEBHOOK_SECRET,
     }
 
     return config
 
 
-EXPIRATION_TIME_LIMIT_SECONDS = 86400
+# Доля файлов, которые должны успешно обработаться, чтобы удалить пропавшие с сайта
+SWEEP_MIN_COMPLETENESS = 0.9
+SCHEDULE_VERSIONS_LIMIT = 10
+SUBSCRIPTIONS_PAGE_SIZE = 5
+FETCH_MAX_RETRIES = 5
+FETCH_RETRY_BUDGET = 50
+FETCH_TIMEOUT_SECONDS = 60
+CIRCUIT_BREAKER_FAILURE_THRESHOLD = 10
+CIRCUIT_BREAKER_RESET_TIMEOUT_SECONDS = 300
+EVENT_MAX_ATTEMPTS = 5
+WEBHOOK_PATH = "/webhook"
+WEBHOOK_PORT = 8888
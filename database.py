@@ -1,7 +1,8 @@
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from motor.motor_asyncio import AsyncIOMotorClient
 from functools import wraps
-from pymongo import InsertOne, UpdateOne
+from pymongo import InsertOne, UpdateOne, ReturnDocument
+from pymongo.errors import DuplicateKeyError
 
 
 def singleton(cls):
@@ -17,6 +18,21 @@ def singleton(cls):
     return wrapper
 
 
+def diff_pages(old_pages, new_pages):
+    changed = []
+    added = []
+    removed = []
+    for i in range(max(len(old_pages), len(new_pages))):
+        if i >= len(old_pages):
+            added.append(i + 1)
+        elif i >= len(new_pages):
+            removed.append(i + 1)
+        elif old_pages[i] != new_pages[i]:
+            changed.append(i + 1)
+
+    return {"changed": changed, "added": added, "removed": removed}
+
+
 @singleton
 class MongoDB:
     def __init__(self, username, password, host, port, database):
@@ -55,15 +71,25 @@ class MongoDB:
         )
         return response
 
-    async def upsert_schedule(self, documents, time_limit):
+    async def upsert_schedule(self, documents, file_links, generation, versions_limit):
         requests = []
         updated_documents = []
-        current_timestamp = datetime.now().timestamp()
+        versioned_documents = []
+
+        existing_docs = {}
+        response = self.db.schedule.find(
+            {"file_link": {"$in": file_links}}, projection={"bundle": False}
+        )
+        async for existing_doc in response:
+            existing_docs[existing_doc["file_link"]] = existing_doc
+
+        fetched_links = set()
         for document in documents:
             if document is None:
                 continue
+            fetched_links.add(document["file_link"])
             collection_filter = {"file_link": document["file_link"]}
-            existing_doc = await self.db.schedule.find_one(collection_filter)
+            existing_doc = existing_docs.get(document["file_link"])
 
             if (
                 existing_doc
@@ -77,45 +103,220 @@ class MongoDB:
                             "$set": {
                                 "file_last_modified": document["file_last_modified"],
                                 "timestamp": document["timestamp"],
-                            }
+                                "images_filepath": document["images_filepath"],
+                                "page_hashes": document["page_hashes"],
+                                "generation": generation,
+                            },
+                            # Старый bundle ссылается на старые страницы: пока воркер
+                            # не соберёт новый, бот отправляет файлы с диска
+                            "$unset": {"bundle": ""},
                         },
-                        upsert=True,
                     )
                 )
-                updated_documents.append(document)
-            elif (
-                existing_doc
-                and existing_doc["timestamp"] + time_limit > current_timestamp
-            ):
+                updated_document = {**existing_doc, **document}
+                updated_document["pages_diff"] = diff_pages(
+                    existing_doc.get("page_hashes", []), document["page_hashes"]
+                )
+                updated_documents.append(updated_document)
+                versioned_documents.append(document)
+            elif existing_doc:
                 requests.append(
                     UpdateOne(
                         collection_filter,
-                        {"$set": {"timestamp": document["timestamp"]}},
-                        upsert=True,
+                        {
+                            "$set": {
+                                "timestamp": document["timestamp"],
+                                "generation": generation,
+                            }
+                        },
+                    )
+                )
+            else:
+                requests.append(InsertOne({**document, "generation": generation}))
+                versioned_documents.append(document)
+
+        # Файл есть на сайте, но в этом цикле не скачался: помечаем, чтобы не удалить
+        for file_link in file_links:
+            if file_link not in fetched_links and file_link in existing_docs:
+                requests.append(
+                    UpdateOne(
+                        {"file_link": file_link}, {"$set": {"generation": generation}}
                     )
                 )
-            elif not existing_doc:
-                requests.append(InsertOne(document))
 
         if len(requests) == 0:
-            return []
+            return [], []
 
         await self.db.schedule.bulk_write(requests)
-        return updated_documents
+        orphan_filepaths = await self.add_schedule_versions(
+            versioned_documents, versions_limit
+        )
+        return updated_documents, orphan_filepaths
 
-    async def delete_old_documents(self, time_limit):
-        now = datetime.now()
-        threshold = (now - timedelta(seconds=time_limit)).timestamp()
+    async def add_schedule_versions(self, documents, versions_limit):
+        if len(documents) == 0:
+            return []
+
+        version_requests = []
+        page_requests = {}
+        for document in documents:
+            last_version = await self.db.schedule_versions.find_one(
+                {"file_link": document["file_link"]},
+                sort={"version": -1},
+                projection=["version"],
+            )
+            version = 1 if last_version is None else last_version["version"] + 1
+            version_requests.append(
+                InsertOne(
+                    {
+                        "file_link": document["file_link"],
+                        "version": version,
+                        "file_last_modified": document["file_last_modified"],
+                        "timestamp": document["timestamp"],
+                        "pages": document["page_hashes"],
+                    }
+                )
+            )
+            for page_hash, filepath in zip(
+                document["page_hashes"], document["images_filepath"]
+            ):
+                page_requests[page_hash] = UpdateOne(
+                    {"_id": page_hash},
+                    {"$setOnInsert": {"filepath": filepath}},
+                    upsert=True,
+                )
+
+        if len(page_requests) != 0:
+            await self.db.schedule_pages.bulk_write(
+                list(page_requests.values()), ordered=False
+            )
+        await self.db.schedule_versions.bulk_write(version_requests)
+
+        file_links = [document["file_link"] for document in documents]
+        pruned_hashes = await self.prune_schedule_versions(file_links, versions_limit)
+        return await self.delete_orphan_pages(pruned_hashes)
+
+    async def prune_schedule_versions(self, file_links, versions_limit):
+        pruned_ids = []
+        pruned_hashes = set()
+        for file_link in file_links:
+            response = self.db.schedule_versions.find(
+                {"file_link": file_link},
+                sort={"version": -1},
+                skip=versions_limit,
+                projection=["pages"],
+            )
+            async for version in response:
+                pruned_ids.append(version["_id"])
+                pruned_hashes.update(version["pages"])
+
+        if len(pruned_ids) != 0:
+            await self.db.schedule_versions.delete_many({"_id": {"$in": pruned_ids}})
+
+        return pruned_hashes
+
+    async def delete_schedule_versions(self, file_links):
+        collection_filter = {"file_link": {"$in": file_links}}
+        response = self.db.schedule_versions.find(
+            collection_filter, projection=["pages"]
+        )
+        deleted_hashes = set()
+        async for version in response:
+            deleted_hashes.update(version["pages"])
+
+        await self.db.schedule_versions.delete_many(collection_filter)
+
+        return await self.delete_orphan_pages(deleted_hashes)
+
+    async def delete_orphan_pages(self, page_hashes):
+        orphan_hashes = []
+        for page_hash in page_hashes:
+            if await self.db.schedule_versions.find_one(
+                {"pages": page_hash}, projection=["_id"]
+            ):
+                continue
+            if await self.db.schedule.find_one(
+                {"page_hashes": page_hash}, projection=["_id"]
+            ):
+                continue
+            orphan_hashes.append(page_hash)
+
+        if len(orphan_hashes) == 0:
+            return []
+
+        collection_filter = {"_id": {"$in": orphan_hashes}}
+        response = self.db.schedule_pages.find(collection_filter)
+        orphan_filepaths = []
+        async for page in response:
+            orphan_filepaths.append(page["filepath"])
+
+        await self.db.schedule_pages.delete_many(collection_filter)
+
+        return orphan_filepaths
+
+    async def get_schedule_versions(self, file_link):
+        sort_field = "version"
+        sort_direction = -1
+
+        sort_spec = {sort_field: sort_direction}
+        response = self.db.schedule_versions.find(
+            {"file_link": file_link}, sort=sort_spec
+        )
+
+        result = []
+        async for version in response:
+            result.append(version)
+
+        return result
+
+    async def diff_schedule_versions(self, file_link, old_version, new_version):
+        old = await self.db.schedule_versions.find_one(
+            {"file_link": file_link, "version": old_version}
+        )
+        new = await self.db.schedule_versions.find_one(
+            {"file_link": file_link, "version": new_version}
+        )
+        if old is None or new is None:
+            return None
+
+        return diff_pages(old["pages"], new["pages"])
+
+    async def estimated_documents_count(self):
+        return await self.db.schedule.estimated_document_count()
+
+    async def get_last_refresh_cycle(self):
+        return await self.db.refresh_cycles.find_one({"_id": "last"})
+
+    async def save_refresh_cycle(self, generation, listed_count, swept):
+        await self.db.refresh_cycles.update_one(
+            {"_id": "last"},
+            {
+                "$set": {
+                    "generation": generation,
+                    "listed_count": listed_count,
+                    "swept": swept,
+                    "timestamp": datetime.now().timestamp(),
+                }
+            },
+            upsert=True,
+        )
 
-        collection_filter = {"timestamp": {"$lt": threshold}}
+    async def sweep_schedule(self, generation):
+        # Только документы из прошлых циклов: более новый цикл мог уже пометить их
+        collection_filter = {
+            "$or": [
+                {"generation": {"$lt": generation}},
+                {"generation": {"$exists": False}},
+            ]
+        }
 
-        response = self.db.schedule.find(collection_filter)
         deleted_documents = []
-        async for document in response:
+        while True:
+            document = await self.db.schedule.find_one_and_delete(collection_filter)
+            if document is None:
+                break
             deleted_documents.append(document)
 
-        await self.db.schedule.delete_many(collection_filter)
-
         return deleted_documents
 
     async def subscribe_user(self, user_id, document_id):
@@ -147,7 +348,7 @@ class MongoDB:
         response = await self.db.schedule.find_one({"_id": document_id})
         return response
 
-    async def get_documents_by_user_id(self, user_id):
+    async def get_documents_by_user_id(self, user_id, skip=0, limit=0):
         collection_filter = {"subscribers": {"$in": [user_id]}}
         sort_field = "institute_local_name"
         sort_direction = 1
@@ -155,7 +356,9 @@ class MongoDB:
         sort_spec = {sort_field: sort_direction}
 
         # Выполняем запрос к базе данных
-        response = self.db.schedule.find(collection_filter, sort=sort_spec)
+        response = self.db.schedule.find(
+            collection_filter, sort=sort_spec, skip=skip, limit=limit
+        )
 
         result = []
         async for document in response:
@@ -163,5 +366,133 @@ class MongoDB:
 
         return result
 
+    async def count_documents_by_user_id(self, user_id):
+        collection_filter = {"subscribers": {"$in": [user_id]}}
+        return await self.db.schedule.count_documents(collection_filter)
+
+    async def get_documents_for_bundles(self):
+        response = self.db.schedule.find(
+            {}, projection={"subscribers": False, "bundle": False}
+        )
+
+        result = []
+        async for document in response:
+            result.append(document)
+
+        return result
+
+    async def set_bundles(self, bundles):
+        if len(bundles) == 0:
+            return
+
+        requests = [
+            UpdateOne({"_id": document_id}, {"$set": {"bundle": bundle}})
+            for document_id, bundle in bundles.items()
+        ]
+        await self.db.schedule.bulk_write(requests, ordered=False)
+
+    async def get_page_file_ids(self, page_hashes):
+        response = self.db.schedule_pages.find(
+            {"_id": {"$in": list(page_hashes)}, "file_id": {"$exists": True}},
+            projection=["file_id"],
+        )
+
+        result = {}
+        async for page in response:
+            result[page["_id"]] = page["file_id"]
+
+        return result
+
+    async def set_page_file_ids(self, file_ids):
+        if len(file_ids) == 0:
+            return
+
+        requests = [
+            UpdateOne({"_id": page_hash}, {"$set": {"file_id": file_id}})
+            for page_hash, file_id in file_ids.items()
+        ]
+        await self.db.schedule_pages.bulk_write(requests, ordered=False)
+
+    async def add_events(self, events):
+        if len(events) == 0:
+            return
+
+        current_timestamp = datetime.now().timestamp()
+        await self.db.events.insert_many(
+            [
+                {
+                    "type": event_type,
+                    "document": document,
+                    "status": "pending",
+                    "timestamp": current_timestamp,
+                }
+                for event_type, document in events
+            ]
+        )
+
+    async def claim_event(self, claim_timeout=600):
+        now = datetime.now()
+        threshold = (now - timedelta(seconds=claim_timeout)).timestamp()
+
+        collection_filter = {
+            "$or": [
+                {"status": "pending"},
+                {"status": "processing", "claimed_at": {"$lt": threshold}},
+            ]
+        }
+        update = {
+            "$set": {"status": "processing", "claimed_at": now.timestamp()},
+            "$inc": {"attempts": 1},
+        }
+
+        response = await self.db.events.find_one_and_update(
+            collection_filter,
+            update,
+            sort={"timestamp": 1},
+            return_document=ReturnDocument.AFTER,
+        )
+        return response
+
+    async def mark_event_delivered(self, event_id, user_id):
+        await self.db.events.update_one(
+            {"_id": event_id}, {"$addToSet": {"delivered": user_id}}
+        )
+
+    async def complete_event(self, event_id):
+        await self.db.events.delete_one({"_id": event_id})
+
+    async def get_fsm_document(self, key):
+        return await self.db.fsm.find_one({"_id": key})
+
+    async def set_fsm_field(self, key, field, value):
+        await self.db.fsm.update_one(
+            {"_id": key}, {"$set": {field: value}}, upsert=True
+        )
+
+    async def is_throttled(self, key, throttle_time):
+        now = datetime.now(timezone.utc)
+        try:
+            # Истёкший ключ перезаписывается, живой приводит к конфликту _id при upsert
+            await self.db.throttling.update_one(
+                {"_id": key, "expires_at": {"$lte": now}},
+                {"$set": {"expires_at": now + throttle_time}},
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            return True
+        return False
+
+    async def create_indexes(self):
+        await self.db.schedule.create_index("file_link")
+        await self.db.schedule.create_index("generation")
+        await self.db.schedule.create_index("subscribers")
+        await self.db.schedule.create_index("page_hashes")
+        await self.db.schedule_versions.create_index(
+            [("file_link", 1), ("version", -1)]
+        )
+        await self.db.schedule_versions.create_index("pages")
+        await self.db.events.create_index([("status", 1), ("timestamp", 1)])
+        await self.db.throttling.create_index("expires_at", expireAfterSeconds=0)
+
     def close_connection(self):
         self.client.close()
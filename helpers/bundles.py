@@ -0,0 +1,89 @@
+import asyncio
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.types import FSInputFile
+from helpers import helper, stored_text
+from loader import configuration, mongodb
+
+
+async def send_pages(bot, chat_id, filepaths):
+    while True:
+        try:
+            if len(filepaths) == 1:
+                message = await bot.send_photo(
+                    photo=FSInputFile(filepaths[0]),
+                    chat_id=chat_id,
+                    disable_notification=True,
+                )
+                return [message]
+
+            media_group = helper.get_media_groups_from_filepaths(filepaths)[0]
+            return await bot.send_media_group(
+                media=media_group.build(), chat_id=chat_id, disable_notification=True
+            )
+        except TelegramRetryAfter as e:
+            await asyncio.sleep(e.retry_after)
+
+
+async def upload_pages(bot, chat_id, pages):
+    file_ids = {}
+    for pages_chunk in helper.chunks(list(pages.items()), 10):
+        try:
+            messages = await send_pages(
+                bot, chat_id, [filepath for _, filepath in pages_chunk]
+            )
+        except Exception as e:
+            # Документы с этими страницами получат bundle без media
+            print(f"Failed to upload pages to storage chat: {e}")
+            continue
+        for (page_hash, _), message in zip(pages_chunk, messages):
+            file_ids[page_hash] = message.photo[-1].file_id
+
+    await mongodb.set_page_file_ids(file_ids)
+    return file_ids
+
+
+def build_bundle(document, file_ids):
+    page_hashes = document.get("page_hashes", [])
+    media = None
+    if len(page_hashes) != 0 and all(
+        page_hash in file_ids for page_hash in page_hashes
+    ):
+        media = [file_ids[page_hash] for page_hash in page_hashes]
+
+    keyboards = helper.make_document_keyboards(document)
+    return {
+        "caption": stored_text.get_file_params_text(document),
+        "media": media,
+        "keyboards": {
+            name: kb.model_dump(exclude_none=True) for name, kb in keyboards.items()
+        },
+    }
+
+
+async def update_bundles(bot):
+    documents = await mongodb.get_documents_for_bundles()
+    chat_id = configuration["STORAGE_CHAT_ID"]
+
+    file_ids = {}
+    if bot is not None and chat_id is not None:
+        pages = {}
+        for document in documents:
+            pages.update(
+                zip(
+                    document.get("page_hashes", []),
+                    document.get("images_filepath", []),
+                )
+            )
+        file_ids = await mongodb.get_page_file_ids(pages.keys())
+        missing_pages = {
+            page_hash: filepath
+            for page_hash, filepath in pages.items()
+            if page_hash not in file_ids
+        }
+        file_ids.update(await upload_pages(bot, chat_id, missing_pages))
+
+    bundles = {
+        document["_id"]: build_bundle(document, file_ids) for document in documents
+    }
+    await mongodb.set_bundles(bundles)
+    return bundles
@@ -1,247 +1,227 @@
 import asyncio
-import os
-import time
-import pdf2image
-import requests
-import aiohttp
-from PIL import Image
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramRetryAfter,
+)
 from aiogram.types import (
     ReplyKeyboardMarkup,
     KeyboardButton,
     InlineKeyboardButton,
+    InlineKeyboardMarkup,
     FSInputFile,
 )
 from aiogram.utils.keyboard import ReplyKeyboardBuilder, InlineKeyboardBuilder
 from aiogram.utils.media_group import MediaGroupBuilder
-from bs4 import BeautifulSoup
-from urllib.parse import urlparse
 from datetime import datetime
-import pytz
-from config import EXPIRATION_TIME_LIMIT_SECONDS
+from config import EVENT_MAX_ATTEMPTS
 from helpers import stored_text
 from loader import mongodb
 
 
-def get_schedule_data():
-    def normalize_url(url, schema="https"):
-        url = f"{schema}://{url}"
-        url = url.replace("\\", "/")
-        url = url.replace(" ", "%20")
-        return url
-
-    base_url = "https://www.sibsiu.ru/raspisanie/"
-    parsed_url = urlparse(base_url)
-    response = requests.get(base_url)
+def chunks(lst, n):
+    for i in range(0, len(lst), n):
+        yield lst[i : i + n]
 
-    soup = BeautifulSoup(response.text, "lxml")
 
-    file_links = soup.find_all("li", class_="ul_file")
+def get_media_groups(media):
     result = []
+    for media_chunk in chunks(media, 10):
+        album_builder = MediaGroupBuilder()
+        for item in media_chunk:
+            album_builder.add_photo(media=item)
+        result.append(album_builder)
+    return result
 
-    for link in file_links:
-        parent = link.parent
-        while True:
-            if parent.has_attr("class"):
-                if "institut_div" in parent.attrs["class"]:
-                    break
-            parent = parent.parent
-
-        institute_local_name = parent.p.text
-        file_link = normalize_url(
-            url=(parsed_url.hostname + link.a["href"]), schema=parsed_url.scheme
-        )
-        parsed_url = urlparse(file_link)
-        file_name = link.string
-
-        institute_name = parsed_url.path.split("/")[3]
-
-        institute_name = institute_name.lstrip().rstrip()
-        institute_local_name = institute_local_name.lstrip().rstrip()
-        file_name = file_name.lstrip().rstrip()
-        file_link = file_link.lstrip().rstrip()
-
-        result.append(
-            {
-                "institute_name": institute_name,
-                "institute_local_name": institute_local_name,
-                "file_name": file_name,
-                "file_link": file_link,
-            }
-        )
 
-    return result
+def get_media_groups_from_filepaths(images):
+    return get_media_groups([FSInputFile(image) for image in images])
 
 
-def get_last_file_update(response, datetime_format="%a, %d %b %Y %H:%M:%S %Z"):
-    if "Last-Modified" not in response.headers:
-        raise ValueError("Last-Modified header не найден")
+async def send_media(bot, chat_id, media):
+    if len(media) == 1:
+        # Telegram не принимает media group из одной картинки
+        await bot.send_photo(photo=media[0], chat_id=chat_id)
+        return
 
-    last_modified = response.headers["Last-Modified"]
-    timestamp = datetime.strptime(last_modified, datetime_format).timestamp()
-    return timestamp
+    for mg in get_media_groups(media):
+        await bot.send_media_group(media=mg.build(), chat_id=chat_id)
 
 
-def compress_and_save_img(pil_image, file_name, new_size_ratio=0.3, quality=70):
-    pil_image = pil_image.resize(
-        (
-            int(pil_image.size[0] * new_size_ratio),
-            int(pil_image.size[1] * new_size_ratio),
-        ),
-        Image.Resampling.LANCZOS,
-    )
-    try:
-        pil_image.save(file_name, "JPEG", quality=quality, optimize=True)
-    except OSError:
-        pil_image = pil_image.convert("RGB")
-        pil_image.save(file_name, "JPEG", quality=quality, optimize=True)
+def get_document_media(document, pages=None):
+    bundle = document.get("bundle") or {}
+    media = bundle.get("media") or [
+        FSInputFile(image) for image in document["images_filepath"]
+    ]
+    if pages is not None:
+        media = [media[page - 1] for page in pages]
+    return media
 
 
-async def get_filepath_images_from_pdf(response):
-    data = await response.content.read()
-    images = pdf2image.convert_from_bytes(
-        data, dpi=250, thread_count=3, jpegopt={"quality": 70, "optimize": True}
-    )
-    result = []
+def get_document_caption(document):
+    bundle = document.get("bundle") or {}
+    return bundle.get("caption") or stored_text.get_file_params_text(document)
 
-    for i, v in enumerate(images):
-        abs_filepath = os.path.abspath(
-            f"temp/{response.url_obj.parts[3]}-{response.url_obj.name}-{i}.jpg"
-        )
-        compress_and_save_img(v, abs_filepath)
-        result.append(abs_filepath)
 
-    return result
+def get_document_keyboard(document, keyboard_name):
+    bundle = document.get("bundle") or {}
+    keyboards = bundle.get("keyboards") or {}
+    if keyboard_name in keyboards:
+        return InlineKeyboardMarkup.model_validate(keyboards[keyboard_name])
+    return make_document_keyboards(document)[keyboard_name]
 
 
-def chunks(lst, n):
-    for i in range(0, len(lst), n):
-        yield lst[i : i + n]
+def make_document_keyboards(document):
+    subscribe_button = InlineKeyboardButton(
+        text="Подписаться", callback_data=f"subscribe_{document['_id']}"
+    )
+    unsubscribe_button = InlineKeyboardButton(
+        text="Отписаться", callback_data=f"unsubscribe_{document['_id']}"
+    )
+    history_button = InlineKeyboardButton(
+        text="История изменений", callback_data=f"history_{document['_id']}"
+    )
+    return {
+        "subscribe": InlineKeyboardBuilder()
+        .add(subscribe_button, history_button)
+        .as_markup(),
+        "unsubscribe": InlineKeyboardBuilder()
+        .add(unsubscribe_button, history_button)
+        .as_markup(),
+        "notification": InlineKeyboardBuilder().add(unsubscribe_button).as_markup(),
+    }
+
+
+def make_versions_keyboard(document, versions):
+    builder = InlineKeyboardBuilder()
+    latest_version = versions[0]["version"]
+    for version in versions[1:]:
+        old_version = version["version"]
+        builder.row(
+            InlineKeyboardButton(
+                text=f"Сравнить версию {old_version} с версией {latest_version}",
+                callback_data=f"diff_{document['_id']}_{old_version}_{latest_version}",
+            )
+        )
+    return builder.as_markup()
 
 
-def get_media_groups_from_filepaths(images):
-    result = []
-    for images_chunk in chunks(images, 10):
-        album_builder = MediaGroupBuilder()
-        for image in images_chunk:
-            album_builder.add_photo(media=FSInputFile(image))
-        result.append(album_builder)
-    return result
+def make_subscriptions_page(documents, page, pages_count):
+    text = stored_text.get_subscriptions_text(
+        [get_document_caption(document) for document in documents], page, pages_count
+    )
+    builder = InlineKeyboardBuilder()
+    for document in documents:
+        builder.row(
+            InlineKeyboardButton(
+                text=f"Отписаться: {document['file_name']}",
+                callback_data=f"unsubscribe_{document['_id']}_{page}",
+            )
+        )
+
+    navigation = []
+    if page > 0:
+        navigation.append(
+            InlineKeyboardButton(
+                text="« Назад", callback_data=f"subscriptions_{page - 1}"
+            )
+        )
+    if page + 1 < pages_count:
+        navigation.append(
+            InlineKeyboardButton(
+                text="Вперёд »", callback_data=f"subscriptions_{page + 1}"
+            )
+        )
+    if navigation:
+        builder.row(*navigation)
+
+    return text, builder.as_markup()
 
 
 def timestamp_to_local_time(timestamp, timezone_name="Asia/Novokuznetsk"):
+    import pytz
+
     dt = datetime.fromtimestamp(timestamp, pytz.utc)
     tz = pytz.timezone(timezone_name)
     local_dt = dt.astimezone(tz)
     return local_dt.strftime("%Y-%m-%d %H:%M:%S")
 
 
-async def update_schedule_and_notify_users(bot):
-    documents = await collect_data()
-    updated_documents = await mongodb.upsert_schedule(
-        documents, time_limit=EXPIRATION_TIME_LIMIT_SECONDS
-    )
-    deleted_documents = await mongodb.delete_old_documents(
-        time_limit=EXPIRATION_TIME_LIMIT_SECONDS
-    )
-    await notify_users_about_update(bot, updated_documents)
-    await delete_old_schedule_notify_users(bot, deleted_documents)
-
+async def deliver_events(bot, limit=100):
+    for _ in range(limit):
+        event = await mongodb.claim_event()
+        if event is None:
+            return
 
-async def notify_users_about_update(bot, updated_documents):
-    for document in updated_documents:
-        if "subscribers" in document:
-            media_groups = get_media_groups_from_filepaths(document["images_filepath"])
-            text = (
-                f"Расписание обновилось!\n{stored_text.get_file_params_text(document)}"
-            )
-            builder = InlineKeyboardBuilder()
-            kb = builder.add(
-                InlineKeyboardButton(
-                    text="Отписаться", callback_data=f"unsubscribe_{document['_id']}"
-                ),
-            ).as_markup()
-
-            for subscriber in document["subscribers"]:
-                for mg in media_groups:
-                    await bot.send_media_group(media=mg.build(), chat_id=subscriber)
-                await bot.send_message(text=text, reply_markup=kb, chat_id=subscriber)
-
-
-async def delete_old_schedule_notify_users(bot, deleted_documents):
-    for document in deleted_documents:
-        if "subscribers" in document:
-            text = f"Документ не обнаружен на сайте! Подписка отменена!\n{stored_text.get_file_params_text(document)}"
-            for subscriber in document["subscribers"]:
-                await bot.send_message(text=text, chat_id=subscriber)
-
-
-async def fetch(session, link_object, max_retries=10):
-    retries = 0
-    while retries < max_retries:
         try:
-            async with session.get(link_object["file_link"]) as response:
-                last_modified = get_last_file_update(response)
-                link_object["file_last_modified"] = last_modified
-                link_object["images_filepath"] = await get_filepath_images_from_pdf(
-                    response
-                )
-                link_object["timestamp"] = datetime.now().timestamp()
-                return link_object
+            if event["type"] == "schedule_updated":
+                await notify_users_about_update(bot, event)
+            elif event["type"] == "schedule_deleted":
+                await delete_old_schedule_notify_users(bot, event)
         except Exception as e:
-            retries += 1
+            if event["attempts"] < EVENT_MAX_ATTEMPTS:
+                # Событие останется в processing и будет взято снова после claim_timeout
+                print(f"Error delivering event {event['_id']}, will retry: {e}")
+                continue
             print(
-                f"Error processing {link_object['file_link']}: {e}. Retrying (attempt {retries + 1} of {max_retries})"
+                f"Giving up on event {event['_id']} after {event['attempts']} attempts: {e}"
             )
-            await asyncio.sleep(1 + retries)
-    print(f"Failed to process {link_object['file_link']} after {max_retries} retries.")
-    return None
 
+        await mongodb.complete_event(event["_id"])
+
+
+async def deliver_to_subscribers(event, send):
+    delivered = event.get("delivered", [])
+    for subscriber in event["document"].get("subscribers", []):
+        if subscriber in delivered:
+            continue
+        while True:
+            try:
+                await send(subscriber)
+            except TelegramRetryAfter as e:
+                await asyncio.sleep(e.retry_after)
+                continue
+            except TelegramForbiddenError as e:
+                # Пользователь заблокировал бота
+                print(f"Skipping subscriber {subscriber}: {e}")
+            except TelegramBadRequest as e:
+                if "chat not found" not in e.message.lower():
+                    raise
+                print(f"Skipping subscriber {subscriber}: {e}")
+            break
+        await mongodb.mark_event_delivered(event["_id"], subscriber)
+
+
+async def notify_users_about_update(bot, event):
+    document = event["document"]
+    pages_diff = document["pages_diff"]
+    if not any(pages_diff.values()):
+        return
+
+    pages = sorted(pages_diff["changed"] + pages_diff["added"])
+    media = get_document_media(document, pages)
+    text = (
+        f"Расписание обновилось!\n{stored_text.get_pages_diff_text(pages_diff)}\n"
+        + get_document_caption(document)
+    )
+    kb = get_document_keyboard(document, "notification")
+
+    async def send(subscriber):
+        if len(media) != 0:
+            await send_media(bot, subscriber, media)
+        await bot.send_message(text=text, reply_markup=kb, chat_id=subscriber)
+
+    await deliver_to_subscribers(event, send)
 
-async def collect_data_in_chunks(link_objects, chunk_size=10, max_retries=10):
-    retries = 0
-    while retries < max_retries:
-        try:
-            start = datetime.now()
-            async with aiohttp.ClientSession() as session:
-                all_results = []
-                tasks = []
-
-                for i in range(0, len(link_objects), chunk_size):
-                    chunk = link_objects[i : i + chunk_size]
-                    for link_object in chunk:
-                        task = asyncio.create_task(fetch(session, link_object))
-                        tasks.append(task)
-
-                for task in asyncio.as_completed(tasks):
-                    try:
-                        result = await task
-                        if result:
-                            all_results.append(result)
-                    except Exception as e:
-                        print(f"An error occurred: {e}")
-
-                end = datetime.now()
-                elapsed = (end - start).total_seconds()
-                print(f"\nSuccessfully processed in {elapsed} seconds.")
-                return all_results
-        except Exception as e:
-            retries += 1
-            print(
-                f"Error processing: {e}. Retrying (attempt {retries + 1} of {max_retries})"
-            )
-            await asyncio.sleep(1 + retries)
-        print(f"Failed to process after {max_retries} retries.")
-        return []
 
+async def delete_old_schedule_notify_users(bot, event):
+    document = event["document"]
+    text = f"Документ не обнаружен на сайте! Подписка отменена!\n{get_document_caption(document)}"
 
-async def collect_data():
-    PATH = os.path.abspath(f"temp")
-    if not os.path.exists(PATH):
-        os.makedirs(PATH)
+    async def send(subscriber):
+        await bot.send_message(text=text, chat_id=subscriber)
 
-    link_objects = get_schedule_data()
-    results = await collect_data_in_chunks(link_objects)
-    return results
+    await deliver_to_subscribers(event, send)
 
 
 def make_row_keyboard(items: list[str], placeholder: str) -> ReplyKeyboardMarkup:
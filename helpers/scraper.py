@@ -0,0 +1,308 @@
+import asyncio
+import hashlib
+import io
+import os
+import pdf2image
+import requests
+import aiohttp
+from PIL import Image
+from bs4 import BeautifulSoup
+from urllib.parse import urlparse
+from datetime import datetime
+from bson import ObjectId
+from helpers import bundles
+from helpers.upstream import (
+    CircuitBreaker,
+    RetryBudget,
+    PermanentFetchError,
+    RetryableFetchError,
+    backoff_delay,
+    check_response_status,
+)
+from config import (
+    SWEEP_MIN_COMPLETENESS,
+    SCHEDULE_VERSIONS_LIMIT,
+    FETCH_MAX_RETRIES,
+    FETCH_RETRY_BUDGET,
+    FETCH_TIMEOUT_SECONDS,
+    CIRCUIT_BREAKER_FAILURE_THRESHOLD,
+    CIRCUIT_BREAKER_RESET_TIMEOUT_SECONDS,
+)
+from loader import mongodb
+
+upstream_health = CircuitBreaker(
+    failure_threshold=CIRCUIT_BREAKER_FAILURE_THRESHOLD,
+    reset_timeout=CIRCUIT_BREAKER_RESET_TIMEOUT_SECONDS,
+)
+
+
+def get_schedule_data():
+    def normalize_url(url, schema="https"):
+        url = f"{schema}://{url}"
+        url = url.replace("\\", "/")
+        url = url.replace(" ", "%20")
+        return url
+
+    base_url = "https://www.sibsiu.ru/raspisanie/"
+    parsed_url = urlparse(base_url)
+    response = requests.get(base_url, timeout=FETCH_TIMEOUT_SECONDS)
+    response.raise_for_status()
+
+    soup = BeautifulSoup(response.text, "lxml")
+
+    file_links = soup.find_all("li", class_="ul_file")
+    result = []
+
+    for link in file_links:
+        parent = link.parent
+        while True:
+            if parent.has_attr("class"):
+                if "institut_div" in parent.attrs["class"]:
+                    break
+            parent = parent.parent
+
+        institute_local_name = parent.p.text
+        file_link = normalize_url(
+            url=(parsed_url.hostname + link.a["href"]), schema=parsed_url.scheme
+        )
+        parsed_url = urlparse(file_link)
+        file_name = link.string
+
+        institute_name = parsed_url.path.split("/")[3]
+
+        institute_name = institute_name.lstrip().rstrip()
+        institute_local_name = institute_local_name.lstrip().rstrip()
+        file_name = file_name.lstrip().rstrip()
+        file_link = file_link.lstrip().rstrip()
+
+        result.append(
+            {
+                "institute_name": institute_name,
+                "institute_local_name": institute_local_name,
+                "file_name": file_name,
+                "file_link": file_link,
+            }
+        )
+
+    return result
+
+
+def get_last_file_update(response, datetime_format="%a, %d %b %Y %H:%M:%S %Z"):
+    if "Last-Modified" not in response.headers:
+        raise PermanentFetchError("Last-Modified header не найден")
+
+    last_modified = response.headers["Last-Modified"]
+    timestamp = datetime.strptime(last_modified, datetime_format).timestamp()
+    return timestamp
+
+
+def compress_img(pil_image, new_size_ratio=0.3, quality=70):
+    pil_image = pil_image.resize(
+        (
+            int(pil_image.size[0] * new_size_ratio),
+            int(pil_image.size[1] * new_size_ratio),
+        ),
+        Image.Resampling.LANCZOS,
+    )
+    buffer = io.BytesIO()
+    try:
+        pil_image.save(buffer, "JPEG", quality=quality, optimize=True)
+    except OSError:
+        pil_image = pil_image.convert("RGB")
+        buffer = io.BytesIO()
+        pil_image.save(buffer, "JPEG", quality=quality, optimize=True)
+    return buffer.getvalue()
+
+
+def save_page_img(pil_image):
+    data = compress_img(pil_image)
+    page_hash = hashlib.sha256(data).hexdigest()
+    abs_filepath = os.path.abspath(f"temp/pages/{page_hash}.jpg")
+    if not os.path.exists(abs_filepath):
+        with open(abs_filepath, "wb") as file:
+            file.write(data)
+    return page_hash, abs_filepath
+
+
+def get_pages_from_pdf(data, content_type=None):
+    if not data.startswith(b"%PDF"):
+        raise PermanentFetchError(f"Файл не является PDF ({content_type})")
+    try:
+        images = pdf2image.convert_from_bytes(
+            data, dpi=250, thread_count=3, jpegopt={"quality": 70, "optimize": True}
+        )
+    except (
+        pdf2image.exceptions.PDFPageCountError,
+        pdf2image.exceptions.PDFSyntaxError,
+    ) as e:
+        raise PermanentFetchError(f"Не удалось прочитать PDF: {e}")
+    page_hashes = []
+    filepaths = []
+
+    for image in images:
+        page_hash, abs_filepath = save_page_img(image)
+        page_hashes.append(page_hash)
+        filepaths.append(abs_filepath)
+
+    return page_hashes, filepaths
+
+
+def delete_files(filepaths):
+    for filepath in filepaths:
+        try:
+            os.remove(filepath)
+        except FileNotFoundError:
+            pass
+
+
+def is_cycle_complete(link_objects, documents, previous_listed_count):
+    if len(link_objects) == 0:
+        return False
+    # Страница со списком файлов могла отдаться не полностью. Сравниваем с прошлым
+    # циклом: если файлов действительно стало меньше, следующий цикл это подтвердит
+    if len(link_objects) < previous_listed_count * SWEEP_MIN_COMPLETENESS:
+        return False
+    # Битые ссылки на сайте не мешают считать цикл полным
+    permanent_errors = sum(
+        1 for link_object in link_objects if "permanent_error" in link_object
+    )
+    processed = len(documents) + permanent_errors
+    return processed >= len(link_objects) * SWEEP_MIN_COMPLETENESS
+
+
+async def update_schedule(bot=None):
+    collected_data = await collect_data()
+    if collected_data is None:
+        return
+    link_objects, documents = collected_data
+
+    generation = ObjectId()
+    last_refresh_cycle = await mongodb.get_last_refresh_cycle()
+    if last_refresh_cycle is not None:
+        previous_listed_count = last_refresh_cycle["listed_count"]
+    else:
+        previous_listed_count = await mongodb.estimated_documents_count()
+    updated_documents, orphan_filepaths = await mongodb.upsert_schedule(
+        documents,
+        file_links=[link_object["file_link"] for link_object in link_objects],
+        generation=generation,
+        versions_limit=SCHEDULE_VERSIONS_LIMIT,
+    )
+
+    deleted_documents = []
+    swept = is_cycle_complete(link_objects, documents, previous_listed_count)
+    if swept:
+        deleted_documents = await mongodb.sweep_schedule(generation)
+    else:
+        print(
+            f"Refresh cycle incomplete ({len(documents)} of {len(link_objects)} files, "
+            + f"{previous_listed_count} listed in previous cycle), skipping sweep."
+        )
+    if len(link_objects) != 0:
+        await mongodb.save_refresh_cycle(generation, len(link_objects), swept)
+    if len(deleted_documents) != 0:
+        orphan_filepaths += await mongodb.delete_schedule_versions(
+            [document["file_link"] for document in deleted_documents]
+        )
+    try:
+        document_bundles = await bundles.update_bundles(bot)
+    except Exception as e:
+        # Изменения уже в базе: события и удаление файлов не должны теряться
+        print(f"Failed to update bundles: {e}")
+        document_bundles = {}
+    for document in updated_documents:
+        document["bundle"] = document_bundles.get(document["_id"])
+    await mongodb.add_events(
+        [("schedule_updated", document) for document in updated_documents]
+        + [("schedule_deleted", document) for document in deleted_documents]
+    )
+    delete_files(orphan_filepaths)
+
+
+async def fetch(
+    session, link_object, retry_budget, semaphore, max_retries=FETCH_MAX_RETRIES
+):
+    attempt = 0
+    while upstream_health.allow_request():
+        try:
+            async with semaphore:
+                async with session.get(link_object["file_link"]) as response:
+                    check_response_status(response)
+                    last_modified = get_last_file_update(response)
+                    content_type = response.headers.get("Content-Type")
+                    data = await response.content.read()
+                upstream_health.record_success()
+
+                # Рендер вне таймаута запроса и вне event loop, чтобы не задерживать
+                # остальные загрузки
+                page_hashes, filepaths = await asyncio.to_thread(
+                    get_pages_from_pdf, data, content_type
+                )
+            link_object["file_last_modified"] = last_modified
+            link_object["page_hashes"] = page_hashes
+            link_object["images_filepath"] = filepaths
+            link_object["timestamp"] = datetime.now().timestamp()
+            return link_object
+        except PermanentFetchError as e:
+            # Сайт ответил, повторять запрос бессмысленно
+            upstream_health.record_success()
+            link_object["permanent_error"] = str(e)
+            print(f"Skipping {link_object['file_link']}: {e}")
+            return None
+        except (aiohttp.ClientError, asyncio.TimeoutError, RetryableFetchError) as e:
+            upstream_health.record_failure()
+            attempt += 1
+            if attempt >= max_retries or not retry_budget.try_spend():
+                print(
+                    f"Failed to process {link_object['file_link']} after {attempt} attempts: {e}"
+                )
+                return None
+            await asyncio.sleep(backoff_delay(attempt))
+        except Exception as e:
+            print(f"Error processing {link_object['file_link']}: {e}")
+            return None
+    return None
+
+
+async def collect_data_in_chunks(link_objects, chunk_size=10):
+    start = datetime.now()
+    retry_budget = RetryBudget(FETCH_RETRY_BUDGET)
+    semaphore = asyncio.Semaphore(chunk_size)
+    timeout = aiohttp.ClientTimeout(total=FETCH_TIMEOUT_SECONDS)
+
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        results = await asyncio.gather(
+            *[
+                fetch(session, link_object, retry_budget, semaphore)
+                for link_object in link_objects
+            ]
+        )
+
+    all_results = [result for result in results if result]
+    elapsed = (datetime.now() - start).total_seconds()
+    print(
+        f"\nProcessed {len(all_results)} of {len(link_objects)} files in {elapsed} seconds "
+        + f"(retry budget left: {retry_budget.remaining}, circuit: {upstream_health.state})."
+    )
+    return all_results
+
+
+async def collect_data():
+    PATH = os.path.abspath(f"temp/pages")
+    if not os.path.exists(PATH):
+        os.makedirs(PATH)
+
+    if not upstream_health.allow_request():
+        print("Upstream circuit is open, skipping refresh cycle.")
+        return None
+
+    try:
+        link_objects = await asyncio.to_thread(get_schedule_data)
+    except requests.RequestException as e:
+        upstream_health.record_failure()
+        print(f"Failed to load schedule page: {e}")
+        return None
+    upstream_health.record_success()
+
+    results = await collect_data_in_chunks(link_objects)
+    return link_objects, results
@@ -13,3 +13,40 @@ def get_file_params_text(document):
 {hbold('Имя файла')}: {hlink(document['file_name'], document['file_link'])}
 {hbold('Дата обновления на сайте')}: {helper.timestamp_to_local_time(document['file_last_modified'])}
 {hbold('Дата обновления в боте')}: {helper.timestamp_to_local_time(document['timestamp'])}"""
+
+
+def get_pages_diff_text(pages_diff):
+    rows = []
+    if pages_diff["changed"]:
+        rows.append(f"изменены страницы {', '.join(map(str, pages_diff['changed']))}")
+    if pages_diff["added"]:
+        rows.append(f"добавлены страницы {', '.join(map(str, pages_diff['added']))}")
+    if pages_diff["removed"]:
+        rows.append(f"удалены страницы {', '.join(map(str, pages_diff['removed']))}")
+    if not rows:
+        rows.append("страницы не изменились")
+    return "; ".join(rows).capitalize()
+
+
+def get_versions_text(document, versions, pages_diffs):
+    rows = [f"{hbold('История изменений')}: {document['file_name']}"]
+    for version, pages_diff in zip(versions, pages_diffs):
+        title = hbold(f"Версия {version['version']}")
+        row = f"{title} от {helper.timestamp_to_local_time(version['file_last_modified'])}"
+        if pages_diff is not None:
+            row += f": {get_pages_diff_text(pages_diff)}"
+        rows.append(row)
+    return "\n".join(rows)
+
+
+def get_versions_diff_text(document, old_version, new_version, pages_diff):
+    title = hbold(f"Версия {old_version} → версия {new_version}")
+    return f"""{title}: {document['file_name']}
+{get_pages_diff_text(pages_diff)}"""
+
+
+def get_subscriptions_text(captions, page, pages_count):
+    text = "\n\n".join(captions)
+    if pages_count > 1:
+        text += f"\n\n{hbold('Страница')}: {page + 1} из {pages_count}"
+    return text
@@ -0,0 +1,69 @@
+import random
+import time
+
+
+# Ошибка, которую бессмысленно повторять: 404, не PDF, битый файл
+class PermanentFetchError(Exception):
+    pass
+
+
+# Временная ошибка сайта: 5xx, 408, 429
+class RetryableFetchError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+
+    @property
+    def state(self):
+        return "closed" if self.opened_at is None else "open"
+
+    def allow_request(self):
+        if self.opened_at is None:
+            return True
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            # Пропускаем один пробный запрос, остальные ждут ещё reset_timeout
+            self.opened_at = time.monotonic()
+            return True
+        return False
+
+    def record_success(self):
+        if self.opened_at is not None:
+            print("Upstream recovered, circuit closed.")
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.opened_at is None and self.failures >= self.failure_threshold:
+            print(f"Upstream failed {self.failures} times in a row, circuit opened.")
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+
+class RetryBudget:
+    def __init__(self, retries):
+        self.remaining = retries
+
+    def try_spend(self):
+        if self.remaining <= 0:
+            return False
+        self.remaining -= 1
+        return True
+
+
+def backoff_delay(attempt, base=1, cap=60):
+    # Exponential backoff с full jitter
+    return random.uniform(0, min(cap, base * 2**attempt))
+
+
+def check_response_status(response):
+    if response.status in (408, 429) or response.status >= 500:
+        raise RetryableFetchError(f"HTTP {response.status}")
+    if response.status >= 400:
+        raise PermanentFetchError(f"HTTP {response.status}")
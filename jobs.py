@@ -1,15 +1,30 @@
 from datetime import datetime
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from helpers import helper
 
 
 def set_scheduled_jobs(scheduler, bot):
+    from helpers import helper
+
     scheduler.add_job(
-        helper.update_schedule_and_notify_users,
+        helper.deliver_events,
+        "interval",
+        seconds=30,
+        args=(bot,),
+        next_run_time=datetime.now(),
+        max_instances=1,
+    )
+
+
+def set_worker_jobs(scheduler, bot):
+    from helpers import scraper
+
+    scheduler.add_job(
+        scraper.update_schedule,
         "interval",
         hours=6,
         args=(bot,),
         next_run_time=datetime.now(),
+        max_instances=1,
     )
 
 
@@ -17,3 +32,9 @@ def init_jobs(bot):
     scheduler = AsyncIOScheduler()
     set_scheduled_jobs(scheduler, bot)
     scheduler.start()
+
+
+def init_worker_jobs(bot):
+    scheduler = AsyncIOScheduler()
+    set_worker_jobs(scheduler, bot)
+    scheduler.start()
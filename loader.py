@@ -1,7 +1,7 @@
 import config
 from database import MongoDB
 from aiogram import Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
+from FSMStates.storage import MongoStorage
 
 configuration = config.get_environment()
 
@@ -13,4 +13,4 @@ mongodb = MongoDB(
     database=configuration["MONGODB_DATABASE"],
 )
 
-dp = Dispatcher(storage=MemoryStorage())
+dp = Dispatcher(storage=MongoStorage(mongodb))
@@ -1,21 +1,23 @@
 import asyncio
 import logging
+import math
 import sys
 
 from aiogram.client.default import DefaultBotProperties
-from aiogram.utils.keyboard import InlineKeyboardBuilder
 from bson import ObjectId
 
 from FSMStates.schedule import SelectSchedule
 from middlewares.throttling import ThrottlingMiddleware
 from loader import dp, mongodb, configuration
+from config import SUBSCRIPTIONS_PAGE_SIZE, WEBHOOK_PATH, WEBHOOK_PORT
+from database import diff_pages
 from helpers import helper, stored_text
 import jobs
 
 from aiogram import Bot, flags, F
 from aiogram.enums import ParseMode
 from aiogram.filters import CommandStart, Command, StateFilter
-from aiogram.types import Message, BotCommand, CallbackQuery, InlineKeyboardButton
+from aiogram.types import Message, BotCommand, CallbackQuery
 
 from aiogram.utils.chat_action import ChatActionMiddleware
 from aiogram.fsm.context import FSMContext
@@ -77,51 +79,64 @@ async def file_name_chosen(message: Message, state: FSMContext):
         institute_local_name=user_data["chosen_institute"], file_name=message.text
     )
 
-    media_groups = helper.get_media_groups_from_filepaths(document["images_filepath"])
-
-    for mg in media_groups:
-        await message.answer_media_group(media=mg.build())
-    text = stored_text.get_file_params_text(document)
-
-    is_user_subscribed = await mongodb.check_is_user_subscribed(
-        message.from_user.id, document["_id"]
+    await helper.send_media(
+        message.bot, message.chat.id, helper.get_document_media(document)
     )
-    builder = InlineKeyboardBuilder()
 
-    if is_user_subscribed:
-        builder.add(
-            InlineKeyboardButton(
-                text="Отписаться", callback_data=f"unsubscribe_{document['_id']}"
-            ),
-        )
-    else:
-        builder.add(
-            InlineKeyboardButton(
-                text="Подписаться", callback_data=f"subscribe_{document['_id']}"
-            ),
-        )
-    kb = builder.as_markup()
+    is_user_subscribed = message.from_user.id in document.get("subscribers", [])
+    kb = helper.get_document_keyboard(
+        document, "unsubscribe" if is_user_subscribed else "subscribe"
+    )
+    text = helper.get_document_caption(document)
     await message.answer(text=text, reply_markup=kb)
 
 
+async def get_subscriptions_page(user_id, page):
+    documents_count = await mongodb.count_documents_by_user_id(user_id)
+    if documents_count == 0:
+        return None
+
+    pages_count = math.ceil(documents_count / SUBSCRIPTIONS_PAGE_SIZE)
+    page = min(page, pages_count - 1)
+    documents = await mongodb.get_documents_by_user_id(
+        user_id=user_id,
+        skip=page * SUBSCRIPTIONS_PAGE_SIZE,
+        limit=SUBSCRIPTIONS_PAGE_SIZE,
+    )
+    return helper.make_subscriptions_page(documents, page, pages_count)
+
+
 @dp.message(StateFilter(None), Command("subscriptions"))
 @flags.chat_action(action="typing")
 async def user_subscriptions(message: Message):
-    documents = await mongodb.get_documents_by_user_id(user_id=message.from_user.id)
+    subscriptions_page = await get_subscriptions_page(message.from_user.id, 0)
 
-    if len(documents) == 0:
+    if subscriptions_page is None:
         await message.answer(text="Вы не подписаны на обновления")
         return
 
-    for document in documents:
-        builder = InlineKeyboardBuilder()
-        kb = builder.add(
-            InlineKeyboardButton(
-                text="Отписаться", callback_data=f"unsubscribe_{document['_id']}"
-            ),
-        ).as_markup()
-        text = stored_text.get_file_params_text(document)
-        await message.answer(text=text, disable_web_page_preview=True, reply_markup=kb)
+    text, kb = subscriptions_page
+    await message.answer(text=text, disable_web_page_preview=True, reply_markup=kb)
+
+
+async def edit_subscriptions_page(callback: CallbackQuery, page):
+    subscriptions_page = await get_subscriptions_page(callback.from_user.id, page)
+
+    if subscriptions_page is None:
+        await callback.message.edit_text(text="Вы не подписаны на обновления")
+        return
+
+    text, kb = subscriptions_page
+    await callback.message.edit_text(
+        text=text, disable_web_page_preview=True, reply_markup=kb
+    )
+
+
+@dp.callback_query(F.data.startswith("subscriptions_"))
+async def user_subscriptions_page(callback: CallbackQuery):
+    page = int(callback.data.split("_")[1])
+    await edit_subscriptions_page(callback, page)
+    await callback.answer()
 
 
 @dp.callback_query(F.data.startswith("subscribe_"))
@@ -144,8 +159,10 @@ async def subscribe_user(callback: CallbackQuery):
 
 @dp.callback_query(F.data.startswith("unsubscribe_"))
 async def unsubscribe_user(callback: CallbackQuery):
-    await callback.message.edit_reply_markup()
-    document_id = ObjectId(callback.data.split("_")[1])
+    callback_data = callback.data.split("_")
+    if len(callback_data) == 2:
+        await callback.message.edit_reply_markup()
+    document_id = ObjectId(callback_data[1])
     document = await mongodb.get_document_by_id(document_id)
     result = await mongodb.unsubscribe_user(callback.from_user.id, document_id)
     if result:
@@ -153,12 +170,63 @@ async def unsubscribe_user(callback: CallbackQuery):
             text=f"Вы отписались от получения обновлений файла: {document['institute_local_name']} "
             + f"{document['file_name']}"
         )
+        if len(callback_data) == 3:
+            # Отписка из списка подписок: перерисовываем текущую страницу
+            await edit_subscriptions_page(callback, int(callback_data[2]))
     else:
         await callback.answer(
             text="Вы не смогли отписаться от получения обновлений", show_alert=True
         )
 
 
+@dp.callback_query(F.data.startswith("history_"))
+async def schedule_history(callback: CallbackQuery):
+    document_id = ObjectId(callback.data.split("_")[1])
+    document = await mongodb.get_document_by_id(document_id)
+    if document is None:
+        await callback.answer(text="Документ не найден", show_alert=True)
+        return
+
+    versions = await mongodb.get_schedule_versions(document["file_link"])
+    if len(versions) == 0:
+        await callback.answer(text="История изменений пуста", show_alert=True)
+        return
+
+    pages_diffs = []
+    for i, version in enumerate(versions):
+        if i + 1 < len(versions):
+            pages_diffs.append(diff_pages(versions[i + 1]["pages"], version["pages"]))
+        else:
+            pages_diffs.append(None)
+
+    text = stored_text.get_versions_text(document, versions, pages_diffs)
+    kb = helper.make_versions_keyboard(document, versions)
+    await callback.message.answer(text=text, reply_markup=kb)
+    await callback.answer()
+
+
+@dp.callback_query(F.data.startswith("diff_"))
+async def schedule_versions_diff(callback: CallbackQuery):
+    _, document_id, old_version, new_version = callback.data.split("_")
+    document = await mongodb.get_document_by_id(ObjectId(document_id))
+    if document is None:
+        await callback.answer(text="Документ не найден", show_alert=True)
+        return
+
+    pages_diff = await mongodb.diff_schedule_versions(
+        document["file_link"], int(old_version), int(new_version)
+    )
+    if pages_diff is None:
+        await callback.answer(text="Версия не найдена", show_alert=True)
+        return
+
+    text = stored_text.get_versions_diff_text(
+        document, old_version, new_version, pages_diff
+    )
+    await callback.message.answer(text=text)
+    await callback.answer()
+
+
 async def setup_bot_commands(bot):
     bot_commands = [
         BotCommand(command="schedule", description="Получить расписание"),
@@ -169,6 +237,30 @@ async def setup_bot_commands(bot):
     await bot.set_my_commands(bot_commands)
 
 
+async def run_webhook(bot):
+    from aiohttp import web
+    from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+    app = web.Application()
+    SimpleRequestHandler(
+        dispatcher=dp, bot=bot, secret_token=configuration["WEBHOOK_SECRET"]
+    ).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+
+    await bot.set_webhook(
+        url=f"{configuration['WEBHOOK_URL']}{WEBHOOK_PATH}",
+        secret_token=configuration["WEBHOOK_SECRET"],
+    )
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host="0.0.0.0", port=WEBHOOK_PORT).start()
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
 async def main() -> None:
     bot = Bot(
         token=configuration["BOT_TOKEN"],
@@ -176,10 +268,16 @@ async def main() -> None:
     )
     await setup_bot_commands(bot)
     try:
+        await mongodb.create_indexes()
         jobs.init_jobs(bot)
         dp.message.middleware(ChatActionMiddleware())
-        dp.message.middleware(ThrottlingMiddleware(throttle_time=5))
-        await dp.start_polling(bot)
+        dp.message.middleware(ThrottlingMiddleware(throttle_time=5, mongodb=mongodb))
+        if configuration["WEBHOOK_URL"] is None:
+            # Long polling допускает только одну реплику фронтенда на токен
+            await bot.delete_webhook()
+            await dp.start_polling(bot)
+        else:
+            await run_webhook(bot)
     finally:
         await bot.session.close()
         mongodb.close_connection()
@@ -1,15 +1,15 @@
 from typing import Any, Awaitable, Callable, Dict
 from aiogram.types import Message
-from cachetools import TTLCache
 from aiogram import BaseMiddleware
 from datetime import timedelta
 
 
 class ThrottlingMiddleware(BaseMiddleware):
-    def __init__(self, throttle_time: int, ignored_users: list[int] = None):
+    def __init__(self, throttle_time: int, mongodb, ignored_users: list[int] = None):
         self.throttle_time = timedelta(seconds=throttle_time)
         self.ignored_users = ignored_users or []
-        self.caches = {"messages": TTLCache(maxsize=10_000, ttl=throttle_time)}
+        # Состояние хранится в MongoDB, чтобы все реплики фронтенда видели одни и те же ключи
+        self.mongodb = mongodb
 
     async def __call__(
         self,
@@ -22,12 +22,10 @@ class ThrottlingMiddleware(BaseMiddleware):
 
         key = f"message:{event.chat.id}:{event.text}"
 
-        if key in self.caches["messages"]:
+        if await self.mongodb.is_throttled(key, self.throttle_time):
             return await event.answer(
                 f"Пожалуйста, подождите {self.throttle_time.seconds} секунд, прежде чем отправлять то же сообщение "
                 + f"снова."
             )
-        else:
-            self.caches["messages"][key] = None
 
         return await handler(event, data)
@@ -0,0 +1,27 @@
+import asyncio
+import logging
+import sys
+
+from aiogram import Bot
+
+from loader import mongodb, configuration
+import jobs
+
+
+async def main() -> None:
+    bot = None
+    if configuration["STORAGE_CHAT_ID"] is not None:
+        bot = Bot(token=configuration["BOT_TOKEN"])
+    try:
+        await mongodb.create_indexes()
+        jobs.init_worker_jobs(bot)
+        await asyncio.Event().wait()
+    finally:
+        if bot is not None:
+            await bot.session.close()
+        mongodb.close_connection()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout)
+    asyncio.run(main())